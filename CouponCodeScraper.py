@@ -1,113 +1,245 @@
 import asyncio
-import aiohttp
 import random
-from typing import List, Tuple
+import time
+from typing import AsyncIterator, Dict, List, Set, Tuple
 
+from pymongo.errors import PyMongoError
+
+import json_codec
 from DatabaseManager import DatabaseManager
+from GraphQLRequestTemplate import GraphQLRequestTemplate
+from HttpTransport import HttpTransport, create_transport
 from Logger import Logger
-from models import CouponCode
+from models import CouponCode, ScrapeRunStats, bearer_fingerprint, parse_graphql_datetime
 from ProxyManager import ProxyManager
+from SpillBuffer import SpillBuffer
+from TokenSource import create_token_source
 from utils import USER_AGENTS
 
+ISSUANCE_REQUEST = GraphQLRequestTemplate(
+    url='https://graphql.studentbeans.com/graphql/v1/query',
+    operation_name='createIssuanceMutation',
+    query='mutation createIssuanceMutation($input: CreateIssuanceInput!) {\n  createIssuance(input: $input) {\n    issuance {\n      uid\n      code {\n        code\n        endDate\n        __typename\n      }\n      sbidNumber\n      affiliateLink\n      affiliateNetwork\n      __typename\n    }\n    __typename\n  }\n}',
+    variables={
+        'input': {
+            'offerUid': 'aa1ccece-26ca-4b11-aca4-4f7469f3985e',
+        },
+    },
+    static_headers={
+        'accept': '*/*',
+        'accept-language': 'en-GB,en;q=0.9,fr-FR;q=0.8,fr;q=0.7,en-US;q=0.6',
+        'content-type': 'application/json',
+        'dnt': '1',
+        'origin': 'https://www.studentbeans.com',
+        'priority': 'u=1, i',
+        'referer': 'https://www.studentbeans.com/',
+        'sec-ch-ua': '"Not)A;Brand";v="99", "Google Chrome";v="127", "Chromium";v="127"',
+        'sec-ch-ua-mobile': '?0',
+        'sec-ch-ua-platform': '"Windows"',
+        'sec-fetch-dest': 'empty',
+        'sec-fetch-mode': 'cors',
+        'sec-fetch-site': 'same-site',
+    }
+)
+
 
 class CouponCodeScraper:
+    # Run summaries MongoDB refused; written before the next run so it doesn't resume a finished run
+    _pending_completions: Dict[str, dict] = {}
+
     def __init__(self):
         self.pm = ProxyManager()
-        self.bearers = []
+        self.tokens = create_token_source()
         self.db = DatabaseManager()
+        self.spill = SpillBuffer()
         self.max_attempts = 3
         self.attempt_delay = 5
         self.batch_size = 20
         self.batch_delay = 20
+        # Bearers looked up per journal/expiry query while streaming the token source
+        self.lookup_batch_size = 1000
+        self.run_id = None
+        self.resumed = False
+        self.fetched = 0
+        self.stats = ScrapeRunStats()
 
     async def initialize(self):
         await self.pm.initialize()
-        await self.load_bearers()
 
-    async def load_bearers(self):
-        try:
-            with open('auth_tokens.txt', 'r') as file:
-                self.bearers = [line.strip() for line in file if line.strip()]
-            Logger.info(f"Loaded {len(self.bearers)} bearer tokens")
-        except FileNotFoundError:
-            Logger.error("auth_tokens.txt file not found")
-            raise
-
-    async def get_coupon_code_from_token(self, bearer: str, session: aiohttp.ClientSession) -> CouponCode | None:
+    async def get_coupon_code_from_token(self, bearer: str, transport: HttpTransport,
+                                         batch_proxy: Dict[str, str] = None) -> CouponCode | None:
         for attempt in range(self.max_attempts):
+            if attempt > 0:
+                self.stats.retries += 1
+            proxy_address = 'direct'
+            started = None
             try:
-                random_proxy = await self.pm.get_proxy()
-                headers = {
-                    'accept': '*/*',
-                    'accept-language': 'en-GB,en;q=0.9,fr-FR;q=0.8,fr;q=0.7,en-US;q=0.6',
-                    'authorization': f'Bearer {bearer}',
-                    'content-type': 'application/json',
-                    'dnt': '1',
-                    'origin': 'https://www.studentbeans.com',
-                    'priority': 'u=1, i',
-                    'referer': 'https://www.studentbeans.com/',
-                    'sec-ch-ua': '"Not)A;Brand";v="99", "Google Chrome";v="127", "Chromium";v="127"',
-                    'sec-ch-ua-mobile': '?0',
-                    'sec-ch-ua-platform': '"Windows"',
-                    'sec-fetch-dest': 'empty',
-                    'sec-fetch-mode': 'cors',
-                    'sec-fetch-site': 'same-site',
-                    'user-agent': random.choice(USER_AGENTS),
-                }
-                json_data = {
-                    'operationName': 'createIssuanceMutation',
-                    'variables': {
-                        'input': {
-                            'offerUid': 'aa1ccece-26ca-4b11-aca4-4f7469f3985e',
-                        },
-                    },
-                    'query': 'mutation createIssuanceMutation($input: CreateIssuanceInput!) {\n  createIssuance(input: $input) {\n    issuance {\n      uid\n      code {\n        code\n        endDate\n        __typename\n      }\n      sbidNumber\n      affiliateLink\n      affiliateNetwork\n      __typename\n    }\n    __typename\n  }\n}',
-                }
-
-                async with session.post('https://graphql.studentbeans.com/graphql/v1/query',
-                                        headers=headers,
-                                        json=json_data,
-                                        proxy=random_proxy.get('http') if random_proxy else None) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    code = str(data['data']['createIssuance']['issuance']['code']['code'])
-                    coupon_code = CouponCode(code)
-                    Logger.info(f"Generated coupon code: {code}")
-                    return coupon_code
+                # Retries always rotate to a fresh proxy
+                random_proxy = batch_proxy if attempt == 0 and batch_proxy else await self.pm.get_proxy()
+                if random_proxy:
+                    proxy_address = f"{random_proxy.get('proxy_address')}:{random_proxy.get('port')}"
+                headers = ISSUANCE_REQUEST.headers(bearer, random.choice(USER_AGENTS))
+
+                started = time.perf_counter()
+                response = await transport.post(ISSUANCE_REQUEST.url,
+                                                headers=headers,
+                                                body=ISSUANCE_REQUEST.body,
+                                                proxy=random_proxy.get('http') if random_proxy else None)
+                data = json_codec.loads(response)
+                issuance = data['data']['createIssuance']['issuance']
+                code = str(issuance['code']['code'])
+                coupon_code = CouponCode(
+                    code,
+                    uid=issuance.get('uid'),
+                    end_date=parse_graphql_datetime(issuance['code'].get('endDate')),
+                    affiliate_link=issuance.get('affiliateLink'),
+                    bearer_id=bearer_fingerprint(bearer)
+                )
+                self.stats.record_attempt(proxy_address, time.perf_counter() - started)
+                Logger.info(f"Generated coupon code: {code}")
+                return coupon_code
 
             except Exception as e:
+                if started is not None:
+                    self.stats.record_attempt(proxy_address, time.perf_counter() - started, e)
                 Logger.warn(f"Attempt {attempt + 1} failed for bearer {bearer}", e)
                 if attempt < self.max_attempts - 1:
                     await asyncio.sleep(self.attempt_delay)
                 else:
+                    self.stats.record_failed_bearer(bearer_fingerprint(bearer))
                     Logger.error(f"All attempts failed for bearer {bearer}", e)
 
         return None
 
-    async def process_batch(self, batch: List[str], session: aiohttp.ClientSession) -> List[CouponCode]:
-        tasks = [self.get_coupon_code_from_token(bearer, session) for bearer in batch]
+    async def process_batch(self, batch: List[str], transport: HttpTransport) -> List[CouponCode]:
+        # A multiplexed transport only saves connections if the batch shares a proxy
+        batch_proxy = None
+        if transport.multiplexed:
+            try:
+                batch_proxy = await self.pm.get_proxy()
+            except Exception as e:
+                # Fall back to per-attempt proxies, whose failures are retried bearer by bearer
+                Logger.warn("Could not pick a proxy for the batch, using one per attempt", e)
+        tasks = [self.get_coupon_code_from_token(bearer, transport, batch_proxy) for bearer in batch]
         results = await asyncio.gather(*tasks)
-        return [coupon for coupon in results if coupon is not None]
-
-    async def generate_all_coupons(self):
-        all_coupons = []
-        async with aiohttp.ClientSession() as session:
-            for i in range(0, len(self.bearers), self.batch_size):
-                batch = self.bearers[i:i + self.batch_size]
-                Logger.info(
-                    f"Processing batch {i // self.batch_size + 1} of {len(self.bearers) // self.batch_size + 1}")
-                coupons = await self.process_batch(batch, session)
-                all_coupons.extend([coupon for coupon in coupons if coupon is not None])
-
-                if i + self.batch_size < len(self.bearers):
+        coupons = [coupon for coupon in results if coupon is not None]
+        # Make the codes durable before journaling their bearers as done
+        await asyncio.to_thread(self.spill.append, coupons)
+        # Journal the batch so a crashed run resumes after it instead of starting over
+        try:
+            await asyncio.to_thread(
+                self.db.record_bearer_results,
+                self.run_id,
+                [(bearer_fingerprint(bearer), coupon) for bearer, coupon in zip(batch, results)]
+            )
+        except PyMongoError as e:
+            # Losing resumability is better than losing the codes already issued in this run
+            Logger.warn(f"Continuing scrape run {self.run_id} without journaling this batch", e)
+        return coupons
+
+    def find_skippable_bearers(self, fingerprints: List[str]) -> Tuple[Set[str], Set[str]]:
+        """
+        Return (finished, valid): bearers already finished in this run and bearers that still hold
+        an unexpired code. If MongoDB fails, nothing is skipped; re-issuing just returns the same code.
+        """
+        try:
+            finished = self.db.get_journaled_bearers(self.run_id, fingerprints) if self.resumed else set()
+            unfinished = [fingerprint for fingerprint in fingerprints if fingerprint not in finished]
+            return finished, self.db.get_bearers_with_valid_codes(unfinished)
+        except PyMongoError as e:
+            Logger.warn(f"Could not check {len(fingerprints)} bearers against MongoDB, issuing for all of them", e)
+            return set(), set()
+
+    async def iter_pending_batches(self) -> AsyncIterator[List[str]]:
+        """
+        Stream bearers from the token source in batches of batch_size, dropping bearers that
+        find_skippable_bearers reports; token reads and lookups run off the event loop
+        """
+        skipped_finished, skipped_valid = 0, 0
+        token_batches = self.tokens.batches(self.lookup_batch_size)
+        batch = []
+        while tokens := await asyncio.to_thread(next, token_batches, None):
+            fingerprints = [bearer_fingerprint(bearer) for bearer in tokens]
+            finished, valid = await asyncio.to_thread(self.find_skippable_bearers, fingerprints)
+            skipped_finished += len(finished)
+            skipped_valid += len(valid)
+            for bearer, fingerprint in zip(tokens, fingerprints):
+                if fingerprint not in finished and fingerprint not in valid:
+                    batch.append(bearer)
+                    if len(batch) == self.batch_size:
+                        yield batch
+                        batch = []
+        if batch:
+            yield batch
+        Logger.info(f"Skipped {skipped_finished} bearers already finished in this run "
+                    f"and {skipped_valid} bearers whose coupon code is still valid")
+
+    async def generate_all_coupons(self) -> int:
+        """Issue codes for every pending bearer, spilling each batch to disk; returns codes fetched in the run"""
+        self.fetched = await asyncio.to_thread(self.db.count_journaled_coupons, self.run_id) if self.resumed else 0
+        async with create_transport() as transport:
+            batch_number = 0
+            async for batch in self.iter_pending_batches():
+                if batch_number > 0:
                     Logger.info(f"Waiting {self.batch_delay} seconds before next batch")
                     await asyncio.sleep(self.batch_delay)
+                batch_number += 1
+                Logger.info(f"Processing batch {batch_number} ({len(batch)} bearers)")
+                coupons = await self.process_batch(batch, transport)
+                self.fetched += len(coupons)
 
-        return all_coupons
+        return self.fetched
 
     async def start(self) -> Tuple[int, int]:
+        started = time.perf_counter()
         await self.initialize()
-        coupons = await self.generate_all_coupons()
-        Logger.info(f"Successfully fetched {len(coupons)} coupon codes out of {len(self.bearers)}")
-        inserted, updated = self.db.bulk_insert_coupon_codes(coupons)
+        await asyncio.to_thread(self.flush_pending_completions)
+        with self.spill.pause_background_drain():
+            self.run_id, self.resumed = await asyncio.to_thread(self.db.get_or_create_scrape_run)
+            if not self.resumed:
+                # Codes still spilled here belong to an earlier, finished run; keep them out of this summary.
+                # A resumed run leaves them in place, since they are the crashed half's codes and count toward it.
+                await self.persist_coupon_codes()
+            fetched = await self.generate_all_coupons()
+            total_bearers = await asyncio.to_thread(self.tokens.count)
+            Logger.info(f"Successfully fetched {fetched} coupon codes out of {total_bearers}")
+            inserted, updated = await self.persist_coupon_codes()
+        # Request stats cover this process only; a resumed run doesn't see the crashed half's requests
+        await self.complete_run({
+            "bearers": total_bearers,
+            "fetched": fetched,
+            "inserted": inserted,
+            "updated": updated,
+            **self.stats.to_bson(time.perf_counter() - started, fetched)
+        })
         return inserted, updated
+
+    async def complete_run(self, summary: dict) -> None:
+        """Mark the run completed, retrying; if MongoDB keeps failing, queue it for the next run"""
+        for attempt in range(self.max_attempts):
+            try:
+                await asyncio.to_thread(self.db.complete_scrape_run, self.run_id, summary)
+                return
+            except PyMongoError as e:
+                Logger.warn(f"Attempt {attempt + 1} to mark scrape run {self.run_id} as completed failed", e)
+                if attempt < self.max_attempts - 1:
+                    await asyncio.sleep(self.attempt_delay)
+        Logger.error(f"Could not mark scrape run {self.run_id} as completed, retrying before the next run")
+        CouponCodeScraper._pending_completions[self.run_id] = summary
+
+    def flush_pending_completions(self) -> None:
+        """Write queued run summaries; raises if MongoDB still refuses, so no finished run gets resumed"""
+        for run_id, summary in list(CouponCodeScraper._pending_completions.items()):
+            self.db.complete_scrape_run(run_id, summary)
+            del CouponCodeScraper._pending_completions[run_id]
+
+    async def persist_coupon_codes(self) -> Tuple[int, int]:
+        """
+        Drain the codes spilled batch by batch during the run into MongoDB.
+        If MongoDB fails, the codes stay on disk for the background drainer.
+        """
+        try:
+            return await asyncio.to_thread(self.spill.drain, self.db)
+        except PyMongoError as e:
+            Logger.warn("MongoDB unavailable, coupon codes kept in the spill buffer until it recovers", e)
+            return 0, 0
@@ -1,11 +1,13 @@
 import os
+import threading
+import uuid
 from datetime import datetime
-from typing import List, Optional, Tuple
+from typing import List, Optional, Set, Tuple
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from pymongo.database import Database as MongoDatabase
-from pymongo import UpdateOne
-from pymongo.errors import DuplicateKeyError, PyMongoError
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from KnownCodesIndex import KnownCodesIndex
 from Logger import Logger
 from models import CouponCode
 
@@ -33,33 +35,76 @@ class DatabaseManager:
         if not self.mongo_uri or not self.db_name:
             raise ValueError("MongoDB URI not found in environment variables")
 
+        # Fail fast when MongoDB is unreachable; scraped codes are spilled to disk meanwhile
+        self.server_selection_timeout_ms = int(os.getenv('MONGODB_TIMEOUT_MS', 5000))
+
         self.client: Optional[MongoClient] = None
-        self.db: Optional[MongoDatabase] = None
+        self._db: Optional[MongoDatabase] = None
+        self._connect_lock = threading.Lock()
+        self._indexes_created = False
+
+        # Codes already stored, so repeats can be told apart without a lookup per code
+        self.known_codes = KnownCodesIndex()
+        self._known_codes_lock = threading.Lock()
 
         # Collection names
         self.notification_channels_collection = 'notification_channels'
         self.coupon_codes_collection = 'coupon_codes'
+        self.coupon_codes_archive_collection = 'coupon_codes_archive'
+        self.scrape_runs_collection = 'scrape_runs'
+        self.scrape_journal_collection = 'scrape_journal'
 
-        # Connect to database
-        self._connect()
+        # Lifecycle settings
+        self.archive_batch_size = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+        self.journal_ttl_seconds = int(os.getenv('SCRAPE_JOURNAL_TTL', 7 * 24 * 60 * 60))  # 7 days
 
-        # Create indexes
-        self._create_indexes()
+        # The connection is opened lazily on first use, see warm_up() for eager startup
+
+    @property
+    def db(self) -> MongoDatabase:
+        """Database handle, connecting on first access"""
+        if self._db is None:
+            self._connect()
+        return self._db
 
     def _connect(self) -> None:
-        """Establish connection to MongoDB"""
-        try:
+        """Create the MongoDB client; pymongo opens its sockets in the background"""
+        with self._connect_lock:
+            if self._db is not None:
+                return
             Logger.info("Connecting to MongoDB...")
-            self.client = MongoClient(self.mongo_uri)
-            self.db = self.client[self.db_name]
-            self.client.server_info()  # Test connection
+            self.client = MongoClient(self.mongo_uri, serverSelectionTimeoutMS=self.server_selection_timeout_ms)
+            self._db = self.client[self.db_name]
+
+    def warm_up(self) -> None:
+        """
+        Verify the connection and create indexes once.
+        Blocking; run it off the event loop at startup so it overlaps with the Discord login.
+        """
+        try:
+            self.db.client.server_info()  # Test connection
             Logger.info("Successfully connected to MongoDB")
         except PyMongoError as e:
             Logger.critical("Failed to connect to MongoDB", e)
             raise
+        self.ensure_indexes()
+        self.load_known_codes()
 
-    def _create_indexes(self) -> None:
-        """Create necessary indexes for collections"""
+    def is_healthy(self) -> bool:
+        """Return True if MongoDB answers a ping"""
+        try:
+            self.db.command("ping")
+            return True
+        except PyMongoError:
+            return False
+
+    def ensure_indexes(self) -> None:
+        """
+        Create necessary indexes for collections, once per process.
+        Safe to call repeatedly; after a failure (e.g. MongoDB down at startup) the next call retries.
+        """
+        if self._indexes_created:
+            return
         try:
             # Create unique index for channel_id
             self.db[self.notification_channels_collection].create_index(
@@ -68,11 +113,60 @@ class DatabaseManager:
             self.db[self.coupon_codes_collection].create_index(
                 "code", unique=True
             )
+            # Claimable stock lookups: unused codes, oldest first
+            self.db[self.coupon_codes_collection].create_index(
+                [("used", 1), ("created_at", 1)]
+            )
+            # Expiry lookups: "which bearers still hold a valid code"
+            self.db[self.coupon_codes_collection].create_index(
+                [("bearer_id", 1), ("end_date", -1)]
+            )
+            # Expired codes are removed by MongoDB's TTL monitor
+            self._create_ttl_index(self.coupon_codes_collection, "end_date")
+
+            # Archive of used codes, kept out of the hot collection
+            self.db[self.coupon_codes_archive_collection].create_index(
+                "code", unique=True
+            )
+            self.db[self.coupon_codes_archive_collection].create_index(
+                [("bearer_id", 1), ("end_date", -1)]
+            )
+
+            # Scrape runs and their per-bearer progress journal
+            self.db[self.scrape_runs_collection].create_index(
+                "run_id", unique=True
+            )
+            self.db[self.scrape_runs_collection].create_index(
+                [("status", 1), ("started_at", -1)]
+            )
+            self.db[self.scrape_runs_collection].create_index(
+                [("status", 1), ("finished_at", -1)]
+            )
+            self.db[self.scrape_journal_collection].create_index(
+                [("run_id", 1), ("bearer_id", 1)], unique=True
+            )
+            self.db[self.scrape_journal_collection].create_index(
+                "finished_at", expireAfterSeconds=self.journal_ttl_seconds
+            )
+            self._indexes_created = True
             Logger.info("Database indexes created successfully")
         except PyMongoError as e:
             Logger.error("Failed to create indexes", e)
             raise
 
+    def _create_ttl_index(self, collection: str, field: str) -> None:
+        """
+        Create a TTL index that expires documents once `field` is in the past.
+        Converts an existing plain index on the same field in place.
+        """
+        try:
+            self.db[collection].create_index(field, expireAfterSeconds=0)
+        except OperationFailure as e:
+            if e.code != 85:  # IndexOptionsConflict
+                raise
+            self.db.command("collMod", collection, index={"keyPattern": {field: 1}, "expireAfterSeconds": 0})
+            Logger.info(f"Converted index on {collection}.{field} to a TTL index")
+
     def add_discord_channel(self, channel_id: str) -> bool:
         """
         Add a Discord channel ID to notification_channels collection
@@ -120,52 +214,113 @@ class DatabaseManager:
             Logger.error("Failed to fetch notification channels", e)
             raise
 
-    def insert_or_update_coupon_code(self, coupon: CouponCode) -> Tuple[int, int]:
+    def get_bearers_with_valid_codes(self, bearer_ids: List[str]) -> Set[str]:
         """
-        Insert a new coupon code or update an existing one
+        Return the subset of bearer_ids whose latest issued code has not expired yet
         """
+        if len(bearer_ids) == 0:
+            return set()
         try:
-            current_timestamp = datetime.utcnow().isoformat()
-            # Check if the coupon code already exists
-            existing_code = self.db[self.coupon_codes_collection].find_one({"code": coupon.code})
-            if existing_code:
-                # Update the existing coupon code
-                self.db[self.coupon_codes_collection].update_one(
-                    {"code": coupon.code},
-                    {"$set": {
-                        "updated_at": current_timestamp,
-                    }}
-                )
-                Logger.info(f"Updated coupon code: {coupon.code}")
-                return 0, 1
-            else:
-                # Insert a new coupon code
-                self.db[self.coupon_codes_collection].insert_one({
-                    "code": coupon.code,
-                    "created_at": current_timestamp,
-                    "updated_at": current_timestamp,
-                    "used": False
-                })
-                Logger.info(f"Inserted new coupon code: {coupon.code}")
-                return 1, 0
-        except PyMongoError as e:
-            Logger.error(f"Error inserting/updating coupon code: {coupon.code}", e)
+            query = {
+                "bearer_id": {"$in": bearer_ids},
+                "end_date": {"$gt": datetime.utcnow()}
+            }
+            valid = set(self.db[self.coupon_codes_collection].distinct("bearer_id", query))
+            valid.update(self.db[self.coupon_codes_archive_collection].distinct("bearer_id", query))
+            return valid
+        except PyMongoError as e:
+            Logger.error("Failed to fetch bearers with valid coupon codes", e)
             raise
 
+    @staticmethod
+    def _issuance_fields(coupon: CouponCode) -> dict:
+        """Issuance metadata returned by the GraphQL API, skipping fields it didn't provide"""
+        doc = coupon.to_bson()
+        for field in ("code", "created_at", "updated_at", "used"):
+            del doc[field]
+        return doc
+
+    def load_known_codes(self) -> None:
+        """
+        Load every stored coupon code, live and archived, into the in-memory known-codes index, once
+        """
+        with self._known_codes_lock:
+            if self.known_codes.loaded:
+                return
+            try:
+                collections = [self.db[self.coupon_codes_collection], self.db[self.coupon_codes_archive_collection]]
+                expected_count = sum(collection.estimated_document_count() for collection in collections)
+                codes = (
+                    doc["code"]
+                    for collection in collections
+                    for doc in collection.find({}, {"code": 1, "_id": 0}, batch_size=10_000)
+                )
+                self.known_codes.load(codes, expected_count)
+            except PyMongoError as e:
+                Logger.error("Failed to load known coupon codes", e)
+                raise
+
     def bulk_insert_coupon_codes(self, coupon_codes: List[CouponCode]) -> Tuple[int, int]:
         """
-        Serially insert or update coupon codes in the coupon_codes collection
+        Insert or update coupon codes in the coupon_codes collection.
+        Repeats are classified from the known-codes index and refreshed in one unordered bulk_write;
+        only codes that are new (or that the index got wrong) need the archive check and an upsert.
         """
         inserted, updated = 0, 0
         if len(coupon_codes) == 0:
             Logger.warn("No coupon codes to insert")
             return inserted, updated
         try:
-            for coupon in coupon_codes:
-                i, u = self.insert_or_update_coupon_code(coupon)
-                inserted += i
-                updated += u
+            self.load_known_codes()
+            collection = self.db[self.coupon_codes_collection]
+            current_timestamp = datetime.utcnow()
+
+            # Last occurrence wins if the same code was issued to more than one bearer
+            coupons = {coupon.code: coupon for coupon in coupon_codes}
+            repeat_codes = [code for code in coupons if code in self.known_codes]
+            new_codes = [code for code in coupons if code not in self.known_codes]
+
+            if repeat_codes:
+                # Also backfills issuance metadata on codes stored before it was recorded
+                result = collection.bulk_write([
+                    UpdateOne(
+                        {"code": code},
+                        {"$set": {"updated_at": current_timestamp, **self._issuance_fields(coupons[code])}}
+                    )
+                    for code in repeat_codes
+                ], ordered=False)
+                updated += result.matched_count
+                if result.matched_count < len(repeat_codes):
+                    # Bloom filter false positives, expired or archived codes: not actually in the collection
+                    present = set(collection.distinct("code", {"code": {"$in": repeat_codes}}))
+                    new_codes.extend(code for code in repeat_codes if code not in present)
+
+            if new_codes:
+                # Already handed out; re-inserting them would distribute the same codes twice
+                archived = set(self.db[self.coupon_codes_archive_collection].distinct(
+                    "code", {"code": {"$in": new_codes}}
+                ))
+                if archived:
+                    Logger.info(f"Skipped {len(archived)} archived coupon codes")
+
+                operations = []
+                for code in new_codes:
+                    if code in archived:
+                        continue
+                    operations.append(UpdateOne(
+                        {"code": code},
+                        {
+                            "$setOnInsert": {"created_at": current_timestamp, "used": False},
+                            "$set": {"updated_at": current_timestamp, **self._issuance_fields(coupons[code])}
+                        },
+                        upsert=True
+                    ))
+                if operations:
+                    result = collection.bulk_write(operations, ordered=False)
+                    inserted += result.upserted_count
+                    updated += len(operations) - result.upserted_count
 
+            self.known_codes.update(coupons)
             Logger.info(f"Inserted {inserted} new coupon codes, updated {updated} existing coupon codes")
             return inserted, updated
         except PyMongoError as e:
@@ -177,20 +332,14 @@ class DatabaseManager:
         Return x unused coupon codes sorted by created_at (oldest first)
         """
         try:
+            # Legacy ISO-string timestamps sort before native dates in BSON order, so they still come out first
             cursor = self.db[self.coupon_codes_collection].find(
                 {"used": False},
                 projection={"_id": 0},
                 sort=[("created_at", 1)]
             ).limit(x)
 
-            unused_coupons = []
-            for doc in cursor:
-                unused_coupons.append(CouponCode(
-                    code=doc['code'],
-                    created_at=doc['created_at'],
-                    updated_at=doc['updated_at'],
-                    used=doc['used']
-                ))
+            unused_coupons = [CouponCode.from_bson(doc) for doc in cursor]
 
             # mark the coupon codes as used
             self.mark_coupon_codes_as_used(unused_coupons)
@@ -209,14 +358,10 @@ class DatabaseManager:
             Logger.warn("No coupon codes to mark as used")
             return
         try:
-            operations = [
-                UpdateOne(
-                    {"code": coupon.code},
-                    {"$set": {"used": True, "updated_at": datetime.utcnow().isoformat()}}
-                )
-                for coupon in coupon_codes
-            ]
-            result = self.db[self.coupon_codes_collection].bulk_write(operations)
+            result = self.db[self.coupon_codes_collection].update_many(
+                {"code": {"$in": [coupon.code for coupon in coupon_codes]}},
+                {"$set": {"used": True, "updated_at": datetime.utcnow()}}
+            )
             Logger.info(f"Marked {result.modified_count} coupon codes as used")
         except PyMongoError as e:
             Logger.error("Failed to mark coupon codes as used", e)
@@ -233,6 +378,141 @@ class DatabaseManager:
             Logger.error("Failed to get coupon codes count", e)
             raise
 
+    def archive_used_coupon_codes(self) -> int:
+        """
+        Move used coupon codes to the archive collection in batches of archive_batch_size.
+        Safe to re-run after a partial failure: already archived codes are skipped.
+        """
+        archived = 0
+        try:
+            while True:
+                batch = list(self.db[self.coupon_codes_collection].find({"used": True}).limit(self.archive_batch_size))
+                if not batch:
+                    break
+
+                archived_at = datetime.utcnow()
+                for doc in batch:
+                    doc["archived_at"] = archived_at
+                try:
+                    self.db[self.coupon_codes_archive_collection].insert_many(batch, ordered=False)
+                except BulkWriteError as e:
+                    # Duplicates are left over from an interrupted run; anything else is a real failure
+                    if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                        raise
+
+                self.db[self.coupon_codes_collection].delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+                archived += len(batch)
+
+            Logger.info(f"Archived {archived} used coupon codes")
+            return archived
+        except PyMongoError as e:
+            Logger.error("Failed to archive used coupon codes", e)
+            raise
+
+    def get_or_create_scrape_run(self) -> Tuple[str, bool]:
+        """
+        Return (run_id, resumed): the latest run that never completed, or a new one
+        """
+        try:
+            runs = self.db[self.scrape_runs_collection]
+            unfinished = runs.find_one({"status": "running"}, {"run_id": 1}, sort=[("started_at", -1)])
+            if unfinished:
+                Logger.info(f"Resuming unfinished scrape run: {unfinished['run_id']}")
+                return unfinished["run_id"], True
+
+            run_id = uuid.uuid4().hex
+            runs.insert_one({
+                "run_id": run_id,
+                "status": "running",
+                "started_at": datetime.utcnow()
+            })
+            Logger.info(f"Started scrape run: {run_id}")
+            return run_id, False
+        except PyMongoError as e:
+            Logger.error("Failed to start scrape run", e)
+            raise
+
+    def record_bearer_results(self, run_id: str, results: List[Tuple[str, Optional[CouponCode]]]) -> None:
+        """
+        Append (bearer_id, coupon or None on failure) outcomes to the run's journal
+        """
+        if len(results) == 0:
+            return
+        finished_at = datetime.utcnow()
+        entries = [
+            {
+                "run_id": run_id,
+                "bearer_id": bearer_id,
+                "status": "success" if coupon else "failed",
+                "coupon": coupon.to_bson() if coupon else None,
+                "finished_at": finished_at
+            }
+            for bearer_id, coupon in results
+        ]
+        try:
+            self.db[self.scrape_journal_collection].insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            # A bearer journaled twice keeps its first outcome
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                Logger.error(f"Failed to journal bearer results for run: {run_id}", e)
+                raise
+        except PyMongoError as e:
+            Logger.error(f"Failed to journal bearer results for run: {run_id}", e)
+            raise
+
+    def get_journaled_bearers(self, run_id: str, bearer_ids: List[str]) -> Set[str]:
+        """
+        Return the subset of bearer_ids that already finished in a run
+        """
+        if len(bearer_ids) == 0:
+            return set()
+        try:
+            return set(self.db[self.scrape_journal_collection].distinct(
+                "bearer_id", {"run_id": run_id, "bearer_id": {"$in": bearer_ids}}
+            ))
+        except PyMongoError as e:
+            Logger.error(f"Failed to load journal for scrape run: {run_id}", e)
+            raise
+
+    def count_journaled_coupons(self, run_id: str) -> int:
+        """
+        Return how many bearers were issued a coupon code in a run
+        """
+        try:
+            return self.db[self.scrape_journal_collection].count_documents({"run_id": run_id, "status": "success"})
+        except PyMongoError as e:
+            Logger.error(f"Failed to count journaled coupon codes for scrape run: {run_id}", e)
+            raise
+
+    def complete_scrape_run(self, run_id: str, summary: dict) -> None:
+        """
+        Mark a scrape run as completed and store its summary
+        """
+        try:
+            self.db[self.scrape_runs_collection].update_one(
+                {"run_id": run_id},
+                {"$set": {"status": "completed", "finished_at": datetime.utcnow(), **summary}}
+            )
+            Logger.info(f"Completed scrape run: {run_id}")
+        except PyMongoError as e:
+            Logger.error(f"Failed to complete scrape run: {run_id}", e)
+            raise
+
+    def get_recent_scrape_runs(self, limit: int) -> List[dict]:
+        """
+        Return the stats of the last `limit` completed scrape runs, newest first
+        """
+        try:
+            cursor = self.db[self.scrape_runs_collection].find(
+                {"status": "completed"},
+                projection={"_id": 0, "failed_bearers_sample": 0},
+                sort=[("finished_at", -1)]
+            ).limit(limit)
+            return list(cursor)
+        except PyMongoError as e:
+            Logger.error("Failed to fetch recent scrape runs", e)
+            raise
+
     def close(self):
         """Close MongoDB connection when object is destroyed"""
         if self.client:
@@ -0,0 +1,28 @@
+from types import MappingProxyType
+from typing import Any, Dict, Mapping
+
+import json_codec
+
+
+class GraphQLRequestTemplate:
+    """
+    A GraphQL operation compiled once: the body is serialized to bytes up front and the static
+    headers are frozen, so a request only costs a header copy with the per-request values swapped in.
+    """
+
+    def __init__(self, url: str, operation_name: str, query: str, variables: Dict[str, Any],
+                 static_headers: Mapping[str, str]):
+        self.url = url
+        self.operation_name = operation_name
+        self.body: bytes = json_codec.dumps({
+            'operationName': operation_name,
+            'variables': variables,
+            'query': query,
+        })
+        self.static_headers = MappingProxyType(dict(static_headers))
+
+    def headers(self, bearer: str, user_agent: str) -> Dict[str, str]:
+        headers = dict(self.static_headers)
+        headers['authorization'] = f'Bearer {bearer}'
+        headers['user-agent'] = user_agent
+        return headers
@@ -0,0 +1,133 @@
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+import aiohttp
+
+from Logger import Logger
+
+
+class HttpTransport(ABC):
+    """
+    Minimal POST interface the scraper needs, so the HTTP client behind it can be swapped.
+    Bodies go out and come back as raw bytes; JSON encoding is left to json_codec.
+    Use as an async context manager; connections are released on exit.
+    """
+    name = 'base'
+    # True when concurrent requests through one proxy share a connection
+    multiplexed = False
+
+    @abstractmethod
+    async def post(self, url: str, headers: Dict[str, str], body: bytes, proxy: Optional[str] = None) -> bytes:
+        """POST body to url, raise on non-2xx status and return the raw response body"""
+
+    async def close(self) -> None:
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class AiohttpTransport(HttpTransport):
+    """HTTP/1.1 over aiohttp; every in-flight request needs its own connection through the proxy"""
+    name = 'aiohttp'
+
+    def __init__(self):
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def post(self, url: str, headers: Dict[str, str], body: bytes, proxy: Optional[str] = None) -> bytes:
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        async with self.session.post(url, headers=headers, data=body, proxy=proxy) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class Http2Transport(HttpTransport):
+    """
+    HTTP/2 over httpx: one client, and so one multiplexed connection, per proxy.
+    Concurrent requests through the same proxy share that connection as separate streams, so the
+    scraper sends a whole batch through one proxy. At most max_clients clients stay open; the least
+    recently used one is closed once its in-flight requests finish.
+    """
+    name = 'http2'
+    multiplexed = True
+
+    def __init__(self, http1: bool = True):
+        try:
+            import httpx
+        except ImportError:
+            Logger.critical("HTTP/2 transport requires httpx with HTTP/2 support: pip install 'httpx[http2]'")
+            raise
+        self._httpx = httpx
+        # http1=False forces HTTP/2 with prior knowledge, which plain-text (h2c) endpoints need
+        self.http1 = http1
+        self.timeout = httpx.Timeout(30.0)
+        self.max_clients = int(os.getenv('HTTP2_MAX_CLIENTS', 4))
+        self.clients: OrderedDict[Optional[str], Any] = OrderedDict()
+        self._in_flight: Dict[Any, int] = {}
+        self._retired: Set[Any] = set()
+
+    async def _get_client(self, proxy: Optional[str]):
+        client = self.clients.get(proxy)
+        if client is not None:
+            self.clients.move_to_end(proxy)
+            return client
+
+        client = self._httpx.AsyncClient(http1=self.http1, http2=True, proxy=proxy, timeout=self.timeout)
+        self.clients[proxy] = client
+        while len(self.clients) > self.max_clients:
+            _, evicted = self.clients.popitem(last=False)
+            await self._retire(evicted)
+        return client
+
+    async def _retire(self, client) -> None:
+        if self._in_flight.get(client, 0):
+            self._retired.add(client)
+        else:
+            self._in_flight.pop(client, None)
+            await client.aclose()
+
+    async def post(self, url: str, headers: Dict[str, str], body: bytes, proxy: Optional[str] = None) -> bytes:
+        client = await self._get_client(proxy)
+        self._in_flight[client] = self._in_flight.get(client, 0) + 1
+        try:
+            response = await client.post(url, headers=headers, content=body)
+            response.raise_for_status()
+            return response.content
+        finally:
+            self._in_flight[client] -= 1
+            if client in self._retired and not self._in_flight[client]:
+                self._retired.discard(client)
+                await self._retire(client)
+
+    async def close(self) -> None:
+        for client in list(self.clients.values()) + list(self._retired):
+            await client.aclose()
+        self.clients.clear()
+        self._retired.clear()
+        self._in_flight.clear()
+
+
+TRANSPORTS = {
+    AiohttpTransport.name: AiohttpTransport,
+    Http2Transport.name: Http2Transport,
+}
+
+
+def create_transport(name: Optional[str] = None) -> HttpTransport:
+    """Build the transport named by `name` or the SCRAPER_TRANSPORT env var (default: aiohttp)"""
+    name = name or os.getenv('SCRAPER_TRANSPORT', AiohttpTransport.name)
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown scraper transport '{name}', expected one of: {', '.join(TRANSPORTS)}")
+    Logger.info(f"Using {name} transport for GraphQL requests")
+    return TRANSPORTS[name]()
@@ -0,0 +1,73 @@
+import hashlib
+import math
+import os
+from typing import Iterable
+
+from dotenv import load_dotenv
+
+from Logger import Logger
+
+load_dotenv()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings; false positives possible, false negatives not"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: k positions from the two halves of a single 128-bit digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class KnownCodesIndex:
+    """
+    In-process record of every coupon code already stored, used to tell new codes from repeats
+    without asking MongoDB. Exact for histories up to KNOWN_CODES_BLOOM_THRESHOLD codes, a Bloom
+    filter above that; callers must treat "known" as a hint and verify it against the database.
+    """
+
+    def __init__(self):
+        self.bloom_threshold = int(os.getenv('KNOWN_CODES_BLOOM_THRESHOLD', 1_000_000))
+        self.bloom_error_rate = float(os.getenv('KNOWN_CODES_BLOOM_ERROR_RATE', 0.001))
+        self.loaded = False
+        self._codes = set()
+
+    def load(self, codes: Iterable[str], expected_count: int) -> None:
+        """Replace the index with `codes`, sizing it for expected_count plus room to grow"""
+        if expected_count > self.bloom_threshold:
+            self._codes = BloomFilter(expected_count * 2, self.bloom_error_rate)
+            kind = "a Bloom filter"
+        else:
+            self._codes = set()
+            kind = "an exact set"
+        count = 0
+        for code in codes:
+            self._codes.add(code)
+            count += 1
+        self.loaded = True
+        Logger.info(f"Loaded {count} known coupon codes into {kind}")
+
+    def add(self, code: str) -> None:
+        self._codes.add(code)
+
+    def update(self, codes: Iterable[str]) -> None:
+        for code in codes:
+            self._codes.add(code)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._codes
@@ -1,9 +1,11 @@
+import asyncio
 import os
 import aiohttp
 
 from random import shuffle
 
 from typing import Dict, List
+import json_codec
 from Logger import Logger
 from dotenv import load_dotenv
 
@@ -27,13 +29,15 @@ class ProxyManager:
         self.proxies: List[Dict[str, str]] = []
         self.current_index: int = 0
         self.uses_count: int = 0
+        self._fetch_lock = asyncio.Lock()
         self._initialized = True
         Logger.info("ProxyManager initialized")
 
     async def initialize(self):
-        """Initialize the proxy pool on first use"""
-        if not self.proxies:
-            await self._fetch_proxies()
+        """Initialize the proxy pool on first use; concurrent callers share a single fetch"""
+        async with self._fetch_lock:
+            if not self.proxies:
+                await self._fetch_proxies()
 
     async def _fetch_proxies(self) -> None:
         """Fetch proxies from Webshare API"""
@@ -53,7 +57,7 @@ class ProxyManager:
                         ) as response:
                             response.raise_for_status()
 
-                            proxies_data = await response.json()
+                            proxies_data = json_codec.loads(await response.read())
                             proxies_list = proxies_data.get('results', [])
 
                             if not proxies_list:
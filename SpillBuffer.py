@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+from DatabaseManager import DatabaseManager
+from Logger import Logger
+from models import CouponCode
+
+load_dotenv()
+
+
+class SpillBuffer:
+    """
+    Durable local buffer for scraped coupon codes.
+
+    Codes are appended to a fsync'd JSON-lines file before they are written to MongoDB, so a
+    run never loses freshly issued codes when the database is slow or down. drain() replays the
+    file into MongoDB in batches; replaying is safe because bulk inserts update existing codes.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SpillBuffer, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self.spill_dir = os.getenv('SPILL_DIR') or os.path.join(Logger.get_project_root(), 'spill')
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self.active_path = os.path.join(self.spill_dir, 'coupon_codes.jsonl')
+        # The active file is renamed here while it's replayed, so new appends never race the drain
+        self.draining_path = os.path.join(self.spill_dir, 'coupon_codes.draining.jsonl')
+        self.drain_batch_size = int(os.getenv('SPILL_DRAIN_BATCH_SIZE', 500))
+
+        self._append_lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._background_drain_pauses = 0
+        self._initialized = True
+        Logger.info("SpillBuffer initialized")
+
+    def append(self, coupon_codes: List[CouponCode]) -> None:
+        """Append coupon codes to the spill file and fsync before returning"""
+        if len(coupon_codes) == 0:
+            return
+        lines = ''.join(
+            json.dumps(coupon.to_bson(), default=datetime.isoformat) + '\n'
+            for coupon in coupon_codes
+        )
+        with self._append_lock:
+            with open(self.active_path, 'a', encoding='utf-8') as file:
+                file.write(lines)
+                file.flush()
+                os.fsync(file.fileno())
+        Logger.info(f"Spilled {len(coupon_codes)} coupon codes to {self.active_path}")
+
+    @contextmanager
+    def pause_background_drain(self):
+        """
+        Hold off the background drainer while a scrape run spills its batches, so the run's own
+        final drain sees (and counts) every code it issued
+        """
+        self._background_drain_pauses += 1
+        try:
+            yield
+        finally:
+            self._background_drain_pauses -= 1
+
+    def is_background_drain_paused(self) -> bool:
+        return self._background_drain_pauses > 0
+
+    def has_pending(self) -> bool:
+        return any(
+            os.path.exists(path) and os.path.getsize(path) > 0
+            for path in (self.draining_path, self.active_path)
+        )
+
+    def drain(self, db: DatabaseManager) -> Tuple[int, int]:
+        """
+        Replay spilled coupon codes into MongoDB in batches.
+        Returns (inserted, updated); on a database error the file is kept and the error re-raised.
+        """
+        with self._drain_lock:
+            if not os.path.exists(self.draining_path):
+                with self._append_lock:
+                    if not os.path.exists(self.active_path):
+                        return 0, 0
+                    os.replace(self.active_path, self.draining_path)
+
+            inserted, updated = 0, 0
+            batch = []
+            with open(self.draining_path, 'r', encoding='utf-8') as file:
+                for line_number, line in enumerate(file, start=1):
+                    try:
+                        batch.append(CouponCode.from_bson(json.loads(line)))
+                    except (ValueError, KeyError) as e:
+                        # A torn last line from a crash mid-append; everything before it is intact
+                        Logger.warn(f"Skipping unreadable spill line {line_number}", e)
+                        continue
+                    if len(batch) >= self.drain_batch_size:
+                        i, u = db.bulk_insert_coupon_codes(batch)
+                        inserted, updated = inserted + i, updated + u
+                        batch = []
+            if batch:
+                i, u = db.bulk_insert_coupon_codes(batch)
+                inserted, updated = inserted + i, updated + u
+
+            os.remove(self.draining_path)
+            Logger.info(f"Drained spill buffer: inserted {inserted}, updated {updated} coupon codes")
+            return inserted, updated
@@ -0,0 +1,106 @@
+import os
+from abc import ABC, abstractmethod
+from itertools import islice
+from typing import Iterator, List, Optional
+
+from dotenv import load_dotenv
+from pymongo.errors import PyMongoError
+
+from DatabaseManager import DatabaseManager
+from Logger import Logger
+
+load_dotenv()
+
+
+class TokenSource(ABC):
+    """
+    Lazily streamed pool of bearer tokens.
+    Every pass re-reads the underlying source, so token changes apply to the next run without a restart.
+    """
+    name = 'base'
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[str]:
+        """Yield tokens one at a time"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Return the number of tokens currently in the source"""
+
+    def batches(self, size: int) -> Iterator[List[str]]:
+        """Yield tokens in lists of at most `size`, holding one batch in memory at a time"""
+        tokens = iter(self)
+        while True:
+            batch = list(islice(tokens, size))
+            if not batch:
+                return
+            yield batch
+
+
+class FileTokenSource(TokenSource):
+    """One token per line in a text file, read line by line"""
+    name = 'file'
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            with open(self.path, 'r') as file:
+                for line in file:
+                    token = line.strip()
+                    if token:
+                        yield token
+        except FileNotFoundError:
+            Logger.error(f"{self.path} file not found")
+            raise
+
+    def count(self) -> int:
+        return sum(1 for _ in self)
+
+
+class MongoTokenSource(TokenSource):
+    """
+    Tokens stored as {"token": ..., "active": bool} documents, read in pages keyed on _id.
+    Each page is its own short query rather than one long-lived cursor: the scraper can spend longer
+    than MongoDB's 10-minute idle cursor timeout between pages, which would kill a server cursor.
+    """
+    name = 'mongo'
+
+    def __init__(self, collection: str = 'auth_tokens', page_size: int = 1000):
+        self.db = DatabaseManager()
+        self.collection = collection
+        self.page_size = page_size
+        self.query = {"active": {"$ne": False}}
+
+    def __iter__(self) -> Iterator[str]:
+        last_id = None
+        while True:
+            query = self.query if last_id is None else {**self.query, "_id": {"$gt": last_id}}
+            try:
+                page = list(self.db.db[self.collection].find(query, {"token": 1}).sort("_id", 1).limit(self.page_size))
+            except PyMongoError as e:
+                Logger.error("Failed to stream bearer tokens from MongoDB", e)
+                raise
+            for doc in page:
+                yield doc["token"]
+            if len(page) < self.page_size:
+                return
+            last_id = page[-1]["_id"]
+
+    def count(self) -> int:
+        try:
+            return self.db.db[self.collection].count_documents(self.query)
+        except PyMongoError as e:
+            Logger.error("Failed to count bearer tokens in MongoDB", e)
+            raise
+
+
+def create_token_source(name: Optional[str] = None) -> TokenSource:
+    """Build the token source named by `name` or the TOKEN_SOURCE env var (default: file)"""
+    name = name or os.getenv('TOKEN_SOURCE', FileTokenSource.name)
+    if name == FileTokenSource.name:
+        return FileTokenSource(os.getenv('AUTH_TOKENS_FILE', 'auth_tokens.txt'))
+    if name == MongoTokenSource.name:
+        return MongoTokenSource(os.getenv('AUTH_TOKENS_COLLECTION', 'auth_tokens'))
+    raise ValueError(f"Unknown token source '{name}', expected 'file' or 'mongo'")
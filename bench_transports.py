@@ -0,0 +1,163 @@
+"""
+Benchmark the scraper's HTTP transports against a local stub of the GraphQL endpoint.
+
+The stub speaks HTTP/1.1 and HTTP/2 with prior knowledge (h2c) on the same port, counts the
+TCP connections each transport opens and answers every request after a fixed delay.
+
+    python bench_transports.py --requests 200 --delay 0.05
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import h2.config
+import h2.connection
+import h2.events
+
+import json_codec
+from HttpTransport import TRANSPORTS, AiohttpTransport, Http2Transport
+
+H2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+RESPONSE_BODY = json_codec.dumps({
+    'data': {'createIssuance': {'issuance': {
+        'uid': 'bench-uid',
+        'code': {'code': 'BENCHCODE', 'endDate': '2030-01-01T00:00:00Z', '__typename': 'Code'},
+        'affiliateLink': None,
+    }}}
+})
+
+
+class StubGraphQLServer:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.connections = 0
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            head = await reader.readexactly(len(H2_PREFACE))
+            if head == H2_PREFACE:
+                await self.handle_h2(head, reader, writer)
+            else:
+                await self.handle_h1(head, reader, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_h1(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        buffered = head
+        while True:
+            if b'\r\n\r\n' not in buffered:
+                buffered += await reader.readuntil(b'\r\n\r\n')
+            request_head, _, body = buffered.partition(b'\r\n\r\n')
+            content_length = 0
+            for line in request_head.split(b'\r\n')[1:]:
+                name, _, value = line.partition(b':')
+                if name.strip().lower() == b'content-length':
+                    content_length = int(value.strip())
+            if len(body) < content_length:
+                body += await reader.readexactly(content_length - len(body))
+            buffered = body[content_length:]
+
+            await asyncio.sleep(self.delay)
+            writer.write(
+                b'HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n'
+                b'content-length: ' + str(len(RESPONSE_BODY)).encode() + b'\r\n\r\n' + RESPONSE_BODY
+            )
+            await writer.drain()
+
+    async def handle_h2(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        conn.initiate_connection()
+        pending = set()
+
+        async def respond(stream_id: int):
+            await asyncio.sleep(self.delay)
+            conn.send_headers(stream_id, [
+                (':status', '200'),
+                ('content-type', 'application/json'),
+                ('content-length', str(len(RESPONSE_BODY))),
+            ])
+            conn.send_data(stream_id, RESPONSE_BODY, end_stream=True)
+            writer.write(conn.data_to_send())
+
+        data = head
+        while data:
+            for event in conn.receive_data(data):
+                if isinstance(event, h2.events.DataReceived):
+                    conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    task = asyncio.create_task(respond(event.stream_id))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    return
+            writer.write(conn.data_to_send())
+            await writer.drain()
+            data = await reader.read(65535)
+
+
+def make_transport(name: str):
+    if name == Http2Transport.name:
+        # The stub is plain text, so HTTP/2 has to be spoken with prior knowledge
+        return Http2Transport(http1=False)
+    return TRANSPORTS[name]()
+
+
+async def bench(name: str, total_requests: int, delay: float):
+    server = StubGraphQLServer(delay)
+    await server.start()
+    url = f'http://127.0.0.1:{server.port}/graphql/v1/query'
+    body = json_codec.dumps({'operationName': 'createIssuanceMutation', 'variables': {'input': {'offerUid': 'bench'}}})
+    latencies = []
+
+    async def one(transport):
+        started = time.perf_counter()
+        json_codec.loads(await transport.post(url, headers={'authorization': 'Bearer bench'}, body=body))
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with make_transport(name) as transport:
+        await asyncio.gather(*(one(transport) for _ in range(total_requests)))
+    elapsed = time.perf_counter() - started
+    await server.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        'transport': name,
+        'connections': server.connections,
+        'total_s': round(elapsed, 3),
+        'req_per_s': round(total_requests / elapsed, 1),
+        'p50_ms': round(quantiles[49] * 1000, 1),
+        'p95_ms': round(quantiles[94] * 1000, 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='concurrent requests per transport')
+    parser.add_argument('--delay', type=float, default=0.05, help='stub server response delay in seconds')
+    parser.add_argument('--transports', nargs='+', default=[AiohttpTransport.name, Http2Transport.name])
+    args = parser.parse_args()
+
+    results = [await bench(name, args.requests, args.delay) for name in args.transports]
+    columns = list(results[0])
+    print('  '.join(f'{column:>12}' for column in columns))
+    for result in results:
+        print('  '.join(f'{result[column]:>12}' for column in columns))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,4 +1,6 @@
+import asyncio
 import os
+from collections import Counter
 
 import discord
 from discord import app_commands
@@ -7,12 +9,17 @@ from CouponCodeScraper import CouponCodeScraper
 from Logger import Logger
 from dotenv import load_dotenv
 from discord.ext import tasks
+from pymongo.errors import PyMongoError
 from DatabaseManager import DatabaseManager
+from ProxyManager import ProxyManager
+from SpillBuffer import SpillBuffer
 from utils import get_current_time, notify_users
 
 load_dotenv()
 
 cron_interval = int(os.getenv('CRON_INTERVAL', 60 * 60))  # 1 hour
+archive_interval = int(os.getenv('ARCHIVE_INTERVAL', 6 * 60 * 60))  # 6 hours
+spill_drain_interval = int(os.getenv('SPILL_DRAIN_INTERVAL', 60))  # 1 minute
 
 
 class Bot(discord.Client):
@@ -22,10 +29,18 @@ class Bot(discord.Client):
         super().__init__(intents=intents)
         self.tree = app_commands.CommandTree(self)
         self.db = DatabaseManager()
+        self.sync_task: asyncio.Task | None = None
 
     async def setup_hook(self):
-        await self.tree.sync()
-        Logger.info("Command tree synced")
+        # Syncing is a REST round trip; don't hold up the gateway connection for it
+        self.sync_task = asyncio.create_task(self.sync_commands())
+
+    async def sync_commands(self):
+        try:
+            await self.tree.sync()
+            Logger.info("Command tree synced")
+        except Exception as e:
+            Logger.error('Error syncing command tree:', e)
 
 
 client = Bot()
@@ -188,31 +203,196 @@ async def coupon_codes_count(interaction: discord.Interaction):
     await interaction.followup.send(embed=embed)
 
 
+def _format_trend(newer: list, older: list, unit: str) -> str:
+    newer = [value for value in newer if value is not None]
+    older = [value for value in older if value is not None]
+    if not newer:
+        return "n/a"
+    newer_avg = sum(newer) / len(newer)
+    if not older:
+        return f"{newer_avg:.1f}{unit}"
+    older_avg = sum(older) / len(older)
+    change = (newer_avg - older_avg) / older_avg * 100 if older_avg else 0.0
+    return f"{newer_avg:.1f}{unit} ({change:+.0f}% vs older runs)"
+
+
+@client.tree.command(name="sb-stats", description="Show throughput and latency trends of recent scrape runs")
+async def scrape_stats(interaction: discord.Interaction, runs: app_commands.Range[int, 2, 25] = 10):
+    Logger.info("Received scrape stats request")
+    await interaction.response.defer(thinking=True)
+
+    try:
+        recent_runs = client.db.get_recent_scrape_runs(runs)
+        if recent_runs:
+            lines = []
+            for run in recent_runs:
+                failed = sum(run.get('failures', {}).values())
+                lines.append(
+                    f"`{run['finished_at']:%d %b %H:%M}` {run.get('duration_s', 0):.0f}s, "
+                    f"{run.get('codes_per_s', 0):.2f} codes/s, "
+                    f"p50/p95 {run.get('latency_p50_ms')}/{run.get('latency_p95_ms')} ms, "
+                    f"{run.get('retries', 0)} retries, {failed} failures"
+                )
+
+            # Compare the newer half of the window against the older half
+            half = max(1, len(recent_runs) // 2)
+            newer, older = recent_runs[:half], recent_runs[half:]
+            failure_totals = Counter()
+            proxy_failures = Counter()
+            for run in recent_runs:
+                failure_totals.update(run.get('failures', {}))
+                for proxy in run.get('proxies', []):
+                    proxy_failures[proxy['proxy']] += proxy['failures']
+
+            embed = discord.Embed(
+                title="📈 Scrape Run Stats",
+                description="\n".join(lines),
+                color=0x00ccff
+            )
+            embed.add_field(
+                name="Throughput",
+                value=_format_trend([run.get('codes_per_s') for run in newer],
+                                    [run.get('codes_per_s') for run in older], " codes/s"),
+                inline=False
+            )
+            embed.add_field(
+                name="p95 Latency",
+                value=_format_trend([run.get('latency_p95_ms') for run in newer],
+                                    [run.get('latency_p95_ms') for run in older], " ms"),
+                inline=False
+            )
+            embed.add_field(
+                name="Failure Breakdown",
+                value="\n".join(f"{name}: {count}" for name, count in failure_totals.most_common(5)) or "None",
+                inline=False
+            )
+            embed.add_field(
+                name="Most Failing Proxies",
+                value="\n".join(
+                    f"{proxy}: {count}" for proxy, count in proxy_failures.most_common(5) if count
+                ) or "None",
+                inline=False
+            )
+        else:
+            embed = discord.Embed(
+                title="📈 Scrape Run Stats",
+                description="No completed scrape runs recorded yet.",
+                color=0xffcc00
+            )
+    except Exception as e:
+        Logger.error('Error getting scrape stats:', e)
+        embed = discord.Embed(
+            title="❌ Error",
+            description=f"An error occurred while fetching scrape run stats.\n{str(e)}",
+            color=0xff0000
+        )
+
+    await interaction.followup.send(embed=embed)
+
+
 @tasks.loop(seconds=cron_interval)
 async def cron_job():
     Logger.info("Starting scheduled stock check")
-    scraper = CouponCodeScraper()
-    inserted, updated = await scraper.start()
-    unused_count = client.db.get_unused_coupon_codes_count()
-    embed = discord.Embed(
-        title="Scheduled Stock Check Complete",
-        color=discord.Color.green()
-    )
-    embed.add_field(name="New Coupon Codes Inserted", value=str(inserted), inline=False)
-    embed.add_field(name="Existing Coupon Codes Updated", value=str(updated), inline=False)
-    embed.add_field(name="Total Unused Coupon Codes", value=str(unused_count), inline=False)
-    embed.set_footer(text=f"Completed on {get_current_time()} (UK Time)")
-    await notify_users(
-        client=client,
-        embed=embed
-    )
-    Logger.info(f"Scheduled stock check completed. Next run in {cron_interval} seconds.")
+    try:
+        if not await asyncio.to_thread(client.db.is_healthy):
+            # The run needs MongoDB before its first request; codes issued later survive outages via the spill buffer
+            Logger.warn(f"MongoDB unavailable, skipping scheduled stock check. Next run in {cron_interval} seconds.")
+            return
+
+        scraper = CouponCodeScraper()
+        inserted, updated = await scraper.start()
+        try:
+            unused_count = str(client.db.get_unused_coupon_codes_count())
+        except PyMongoError as e:
+            Logger.warn("Could not count unused coupon codes", e)
+            unused_count = "Unavailable"
+        embed = discord.Embed(
+            title="Scheduled Stock Check Complete",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="New Coupon Codes Inserted", value=str(inserted), inline=False)
+        embed.add_field(name="Existing Coupon Codes Updated", value=str(updated), inline=False)
+        embed.add_field(name="Total Unused Coupon Codes", value=unused_count, inline=False)
+        embed.set_footer(text=f"Completed on {get_current_time()} (UK Time)")
+        await notify_users(
+            client=client,
+            embed=embed
+        )
+        Logger.info(f"Scheduled stock check completed. Next run in {cron_interval} seconds.")
+    except Exception as e:
+        # Keep the loop alive; an unhandled exception would stop it for good
+        Logger.error('Error running scheduled stock check:', e)
+    finally:
+        # Started only once the first run is over, so a run resumed after a restart drains (and counts)
+        # the codes its crashed half spilled instead of the drainer replaying them first
+        if not spill_drain_job.is_running():
+            spill_drain_job.start()
+
+
+@tasks.loop(seconds=archive_interval)
+async def archive_job():
+    Logger.info("Starting scheduled coupon code archival")
+    try:
+        archived = await asyncio.to_thread(client.db.archive_used_coupon_codes)
+        Logger.info(f"Scheduled archival completed, moved {archived} used coupon codes. "
+                    f"Next run in {archive_interval} seconds.")
+    except Exception as e:
+        Logger.error('Error archiving used coupon codes:', e)
+
+
+@tasks.loop(seconds=spill_drain_interval)
+async def spill_drain_job():
+    spill = SpillBuffer()
+    # A running scrape drains its own batches at the end, counting them in its summary
+    pending = spill.has_pending() and not spill.is_background_drain_paused()
+    if not await asyncio.to_thread(client.db.is_healthy):
+        if pending:
+            Logger.warn("MongoDB still unavailable, keeping spilled coupon codes on disk")
+        return
+    try:
+        # No-op once indexes exist; retries if MongoDB was unreachable during startup warm-up
+        await asyncio.to_thread(client.db.ensure_indexes)
+    except Exception as e:
+        Logger.error('Error creating database indexes:', e)
+    # A run may have paused the drainer while the health check was in flight
+    if not pending or spill.is_background_drain_paused():
+        return
+    try:
+        inserted, updated = await asyncio.to_thread(spill.drain, client.db)
+        Logger.info(f"Replayed spilled coupon codes: {inserted} inserted, {updated} updated")
+    except Exception as e:
+        Logger.error('Error draining spill buffer:', e)
 
 
 @client.event
 async def on_ready():
     Logger.info(f"Bot is ready and logged in as {client.user}")
-    cron_job.start()
+    if not cron_job.is_running():
+        cron_job.start()
+    if not archive_job.is_running():
+        archive_job.start()
+
+
+async def warm_up():
+    """Connect to MongoDB and fetch the proxy pool while the bot logs in to Discord"""
+    results = await asyncio.gather(
+        asyncio.to_thread(client.db.warm_up),
+        ProxyManager().initialize(),
+        return_exceptions=True
+    )
+    for name, result in zip(("MongoDB", "proxy pool"), results):
+        if isinstance(result, Exception):
+            Logger.error(f"Failed to warm up {name}", result)
+    Logger.info("Startup warm-up finished")
+
+
+async def start_bot(token: str):
+    async with client:
+        warm_up_task = asyncio.create_task(warm_up())
+        try:
+            await client.start(token)
+        finally:
+            warm_up_task.cancel()
 
 
 def run_bot():
@@ -221,4 +401,8 @@ def run_bot():
         raise ValueError("Discord bot token not found in environment variables")
 
     Logger.info("Starting bot...")
-    client.run(token)
+    discord.utils.setup_logging()
+    try:
+        asyncio.run(start_bot(token))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,30 @@
+import json
+import os
+from typing import Any
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON_CODEC=json forces the stdlib codec; by default orjson is used when installed
+if orjson is not None and os.getenv('JSON_CODEC', 'orjson') == 'orjson':
+    CODEC_NAME = 'orjson'
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(data: bytes | str) -> Any:
+        return orjson.loads(data)
+else:
+    CODEC_NAME = 'json'
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def loads(data: bytes | str) -> Any:
+        return json.loads(data)
@@ -1,23 +1,148 @@
-from datetime import datetime
+import hashlib
+import random
+from datetime import datetime, timezone
+from collections import Counter
+from typing import Any, Dict, List, Mapping
+
+
+def bearer_fingerprint(bearer: str) -> str:
+    """Stable, non-reversible identifier for a bearer token so raw tokens never hit the database"""
+    return hashlib.sha256(bearer.encode('utf-8')).hexdigest()[:32]
+
+
+def parse_graphql_datetime(value: str | None) -> datetime | None:
+    """Parse an ISO-8601 timestamp from the GraphQL API into a naive UTC datetime"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _as_datetime(value: Any) -> datetime | None:
+    # Documents written before timestamps were stored natively, and spilled JSON lines, hold ISO strings
+    if isinstance(value, str):
+        return parse_graphql_datetime(value)
+    return value
 
 
 class CouponCode:
-    def __init__(self, code: str, created_at: str = None, updated_at: str = None, used: bool = False):
+    __slots__ = ('code', 'created_at', 'updated_at', 'used', 'uid', 'end_date', 'affiliate_link', 'bearer_id')
+
+    def __init__(self, code: str, created_at: datetime = None, updated_at: datetime = None, used: bool = False,
+                 uid: str = None, end_date: datetime = None, affiliate_link: str = None, bearer_id: str = None):
         self.code = code
-        self.created_at = created_at or datetime.utcnow().isoformat()
+        self.created_at = created_at or datetime.utcnow()
         self.updated_at = updated_at or self.created_at
         self.used = used
+        self.uid = uid
+        self.end_date = end_date
+        self.affiliate_link = affiliate_link
+        self.bearer_id = bearer_id
 
-    def to_dict(self):
-        return {
+    @classmethod
+    def from_bson(cls, doc: Mapping[str, Any]) -> 'CouponCode':
+        """Build a CouponCode from a coupon_codes document (or any mapping with the same fields)"""
+        get = doc.get
+        return cls(
+            doc['code'],
+            _as_datetime(get('created_at')),
+            _as_datetime(get('updated_at')),
+            get('used', False),
+            get('uid'),
+            _as_datetime(get('end_date')),
+            get('affiliate_link'),
+            get('bearer_id')
+        )
+
+    def to_bson(self) -> Dict[str, Any]:
+        """Document for the coupon_codes collection; issuance fields the API didn't return are left out"""
+        doc = {
             'code': self.code,
             'created_at': self.created_at,
             'updated_at': self.updated_at,
-            'used': self.used
+            'used': self.used,
         }
+        if self.uid is not None:
+            doc['uid'] = self.uid
+        if self.end_date is not None:
+            doc['end_date'] = self.end_date
+        if self.affiliate_link is not None:
+            doc['affiliate_link'] = self.affiliate_link
+        if self.bearer_id is not None:
+            doc['bearer_id'] = self.bearer_id
+        return doc
 
     def __str__(self):
-        return self.to_dict().__str__()
+        return f"CouponCode(code={self.code!r}, used={self.used}, created_at={self.created_at}, end_date={self.end_date})"
 
     def __repr__(self):
         return self.__str__()
+
+
+def _percentile(values: List[float], pct: float) -> float | None:
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class ScrapeRunStats:
+    """Request-level measurements collected during one scrape run, stored on its scrape_runs record"""
+    __slots__ = ('requests', 'latencies', 'retries', 'failures', 'proxy_requests', 'proxy_failures',
+                 'failed_bearers_count', 'failed_bearers_sample')
+    # Enough ids to spot a degrading token without letting a bad run bloat its record
+    FAILED_BEARERS_SAMPLE_SIZE = 20
+    # Latencies kept for the percentiles; a uniform reservoir sample keeps memory flat on huge runs
+    LATENCY_SAMPLE_SIZE = 10_000
+
+    def __init__(self):
+        self.requests = 0
+        self.latencies: List[float] = []
+        self.retries = 0
+        self.failures = Counter()
+        self.proxy_requests = Counter()
+        self.proxy_failures = Counter()
+        self.failed_bearers_count = 0
+        self.failed_bearers_sample: List[str] = []
+
+    def record_attempt(self, proxy: str, latency: float, error: Exception = None) -> None:
+        self.requests += 1
+        if len(self.latencies) < self.LATENCY_SAMPLE_SIZE:
+            self.latencies.append(latency)
+        else:
+            # Reservoir sampling: every attempt so far has the same chance of being in the sample
+            slot = random.randrange(self.requests)
+            if slot < self.LATENCY_SAMPLE_SIZE:
+                self.latencies[slot] = latency
+        self.proxy_requests[proxy] += 1
+        if error is not None:
+            self.failures[type(error).__name__] += 1
+            self.proxy_failures[proxy] += 1
+
+    def record_failed_bearer(self, bearer_id: str) -> None:
+        self.failed_bearers_count += 1
+        if len(self.failed_bearers_sample) < self.FAILED_BEARERS_SAMPLE_SIZE:
+            self.failed_bearers_sample.append(bearer_id)
+
+    def to_bson(self, duration: float, fetched: int) -> Dict[str, Any]:
+        p50, p95 = _percentile(self.latencies, 50), _percentile(self.latencies, 95)
+        return {
+            'duration_s': round(duration, 3),
+            'codes_per_s': round(fetched / duration, 3) if duration > 0 else 0.0,
+            'requests': self.requests,
+            'latency_p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+            'latency_p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            'retries': self.retries,
+            'failures': dict(self.failures),
+            'failed_bearers': self.failed_bearers_count,
+            'failed_bearers_sample': self.failed_bearers_sample,
+            # A list rather than a dict keyed by address: proxy addresses contain dots
+            'proxies': [
+                {'proxy': proxy, 'requests': requests, 'failures': self.proxy_failures[proxy]}
+                for proxy, requests in self.proxy_requests.most_common()
+            ],
+        }